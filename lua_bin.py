@@ -1,42 +1,48 @@
 from __future__ import annotations
 
+import struct
+
 from lua_io import Reader
-from lua_value import LUA_TYPE, Value
-from lua_instruction import Instruction, OPCODES
+from lua_value import Value
+from lua_instruction import (Instruction, OPCODES, MASK_OP, POS_A, MASK_A, POS_B, MASK_B,
+                             POS_C, MASK_C, POS_BX, MASK_BX, MAXARG_SBX)
 from lua_function import LocalVar, Debug, Proto
 from lua_header import Header
 
 
+# The header is all bytes, so it reads the same in either byte order; the other
+# fixed field runs come from the reader, compiled for the chunk's byte order
+_HEADER = struct.Struct('4s8B')
+
+
 def read_header(file: Reader) -> Header:
     header = Header()
-    header.signature = file.read_bytes(4)
+    (header.signature, header.version, header.format, header.endianness, header.int_len,
+     header.size_len, header.inst_len, header.number_len, number_is_int) = file.read_struct(_HEADER)
     if header.signature != b'\x1bLua':
         raise ValueError("Not a valid Lua bytecode file")
-    header.version = file.read_uint8()
-    header.format = file.read_uint8()
-    header.endianness = file.read_uint8()
-    header.int_len = file.read_uint8()
-    header.size_len = file.read_uint8()
-    header.inst_len = file.read_uint8()
-    header.number_len = file.read_uint8()
-    header.number_is_int = (file.read_uint8() != 0)
+    header.number_is_int = (number_is_int != 0)
+    file.set_endianness(header.endianness == 1)
     return header
 
 
-def read_instruction(file: Reader) -> Instruction:
+def decode_instruction(instruction: int) -> Instruction:
     inst = Instruction()
-    inst._args = []
-    inst._comment = []
+    inst._args = ()
+    inst._comment = ()
     
-    inst.instruction = file.read_uint32()
-    # Decode instruction
-    inst._opcode_idx = inst.instruction & 0x3F  # bits 0-5
-    inst._opcode = OPCODES[inst._opcode_idx]
-    inst._a = (inst.instruction >> 6) & 0xFF  # bits 6-13
-    inst._c = (inst.instruction >> 14) & 0x1FF  # bits 14-22
-    inst._b = (inst.instruction >> 23) & 0x1FF  # bits 23-31
-    inst._bx = (inst.instruction >> 14) & 0x3FFFF  # bits 14-31
-    inst._sbx = inst._bx - (0x3FFFF >> 1)  # signed Bx
+    # Decode every field unconditionally; the opcode's mode only matters to readers
+    inst.opcode = instruction & MASK_OP
+    inst._opcode = OPCODES[inst.opcode]
+    inst.a = (instruction >> POS_A) & MASK_A
+    inst.c = (instruction >> POS_C) & MASK_C
+    inst.b = (instruction >> POS_B) & MASK_B
+    bx = (instruction >> POS_BX) & MASK_BX
+    inst.bx = bx
+    inst.sbx = bx - MAXARG_SBX  # signed Bx
+    inst.kb = None
+    inst.kc = None
+    inst.loop_body = None
     
     return inst
 
@@ -44,8 +50,7 @@ def read_instruction(file: Reader) -> Instruction:
 def read_local_var(file: Reader) -> LocalVar:
     locvar = LocalVar()
     locvar.name = file.read_string()
-    locvar.startpc = file.read_uint32()
-    locvar.endpc = file.read_uint32()
+    locvar.startpc, locvar.endpc = file.read_struct(file.locvar_range)
     return locvar
 
 
@@ -53,32 +58,41 @@ def read_debug(file: Reader) -> Debug:
     debug = Debug()
     
     sizelineinfo = file.read_uint32()
-    debug.lineinfos = [file.read_uint32() for _ in range(sizelineinfo)]
+    debug.lineinfos = file.read_uint32_array(sizelineinfo)
     
     sizelocvars = file.read_uint32()
-    debug.locvars = [read_local_var(file) for _ in range(sizelocvars)]
+    locvars = debug.locvars = [None] * sizelocvars
+    for i in range(sizelocvars):
+        locvars[i] = read_local_var(file)
     
     sizeupvalues = file.read_uint32()
-    debug.upvalues = [file.read_string() for _ in range(sizeupvalues)]
+    upvalues = debug.upvalues = [None] * sizeupvalues
+    for i in range(sizeupvalues):
+        upvalues[i] = file.read_string()
     
     return debug
 
 
+# Constant readers indexed by the type tag; None for types a constant can't have
+_CONST_READERS = (
+    lambda file: Value.nil(),                            # LUA_TYPE.NIL
+    lambda file: Value.boolean(file.read_uint8() != 0),  # LUA_TYPE.BOOLEAN
+    None,                                                # LUA_TYPE.LIGHTUSERDATA
+    lambda file: Value.number(file.read_double()),       # LUA_TYPE.NUMBER
+    lambda file: Value.string(file.read_string()),       # LUA_TYPE.STRING
+)
+
+
 def read_value(file: Reader) -> Value:
-    _type = LUA_TYPE(file.read_uint8())
-    if _type == LUA_TYPE.NIL:
-        return Value.nil()
-    elif _type == LUA_TYPE.BOOLEAN:
-        return Value.boolean(file.read_uint8() != 0)
-    elif _type == LUA_TYPE.NUMBER:
-        return Value.number(file.read_double())
-    elif _type == LUA_TYPE.STRING:
-        return Value.string(file.read_string())
-    else:
-        raise ValueError(f"Unknown constant type: {_type}")
+    tag = file.read_uint8()
+    reader = _CONST_READERS[tag] if tag < len(_CONST_READERS) else None
+    if reader is None:
+        raise ValueError(f"Unknown constant type: {tag}")
+    return reader(file)
 
 
-def read_proto(file: Reader, parent: str | None = None) -> Proto:
+def read_proto_head(file: Reader, parent: str | None = None) -> Proto:
+    """Read a prototype up to its sub-protos, which follow in the file before its debug info."""
     proto = Proto()
     proto.source = file.read_string()
     if parent is not None:
@@ -87,29 +101,55 @@ def read_proto(file: Reader, parent: str | None = None) -> Proto:
     else:
         proto.type = "main"
     
-    proto.linedefined = file.read_uint32()
-    proto.lastlinedefined = file.read_uint32()
-    proto.nups = file.read_uint8()
-    proto.numparams = file.read_uint8()
-    proto.is_vararg = file.read_uint8() != 0
-    proto.maxstacksize = file.read_uint8()
+    (proto.linedefined, proto.lastlinedefined, proto.nups, proto.numparams,
+     is_vararg, proto.maxstacksize) = file.read_struct(file.proto_info)
+    proto.is_vararg = is_vararg != 0
+
+    # Lists are allocated at their final length and filled by index, rather than grown
 
     # Code
     sizecode = file.read_uint32()
-    proto.codes = [read_instruction(file) for _ in range(sizecode)]
+    proto.words = file.read_uint32_array(sizecode)
+    codes = proto.codes = [None] * sizecode
+    for pc, word in enumerate(proto.words):
+        codes[pc] = decode_instruction(word)
 
     # Constants
     sizek = file.read_uint32()
-    proto.consts = [read_value(file) for _ in range(sizek)]
+    consts = proto.consts = [None] * sizek
+    for i in range(sizek):
+        consts[i] = read_value(file)
     
-    # Sub-protos
+    # Sub-protos, filled in by read_proto
     sizep = file.read_uint32()
-    proto.protos = [read_proto(file, proto.source) for _ in range(sizep)]
+    proto.protos = [None] * sizep
 
-    # Debug info
+    return proto
+
+
+def read_proto_tail(file: Reader, proto: Proto):
+    """Read a prototype's debug info, once its sub-protos are read, and link its code."""
     proto.debug = read_debug(file)
 
     for pc, code in enumerate(proto.codes):
-        code.update_info(pc, proto.consts, proto.debug.upvalues)
-
-    return proto
+        code.update_consts(proto.consts)
+        code.update_superop(pc, proto.codes)
+    for pc, code in enumerate(proto.codes):
+        code.update_target(pc, proto.codes)
+
+
+def read_proto(file: Reader) -> Proto:
+    """Read the main prototype and every nested one, without recursing per nesting level."""
+    main = read_proto_head(file)
+    # (proto, index of the next sub-proto to read) for each proto still open
+    pending = [(main, 0)]
+    while pending:
+        proto, i = pending[-1]
+        if i < len(proto.protos):
+            pending[-1] = (proto, i + 1)
+            sub = proto.protos[i] = read_proto_head(file, proto.source)
+            pending.append((sub, 0))
+        else:
+            pending.pop()
+            read_proto_tail(file, proto)
+    return main
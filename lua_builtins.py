@@ -14,7 +14,7 @@ class BUILTIN:
         n = state.gettop()
         outputs = []
         for i in range(n):
-            outputs.append(str(state.stack[i]))
+            outputs.append(str(state.stack[state.base + i]))
         print(', '.join(outputs))
         return 0
     
@@ -34,11 +34,12 @@ class BUILTIN:
     
     @staticmethod
     def lua_ipairsaux(state: LuaState) -> int:
-        table = state.stack[0]
-        index = state.stack[1]
+        table = state.stack[state.base]
+        index = state.stack[state.base + 1]
         if not table.is_table():
             raise TypeError("ipairsaux expects a table")
-        index.conv_str_to_number()
+        if not index.is_number():
+            index.conv_str_to_number()
         if not index.is_number():
             raise TypeError("ipairsaux index must be a number")
         next_index = index.value + 1
@@ -62,7 +63,7 @@ class BUILTIN:
         
     @staticmethod
     def lua_ipairs(state: LuaState) -> int:
-        table = state.stack[0]
+        table = state.stack[state.base]
         if not table.is_table():
             raise TypeError("ipairs expects a table")
         state.pushpyfunction(BUILTIN.lua_ipairsaux)
@@ -72,7 +73,7 @@ class BUILTIN:
     
     @staticmethod
     def lua_pairs(state: LuaState) -> int:
-        table = state.stack[0]
+        table = state.stack[state.base]
         if not table.is_table():
             raise TypeError("pairs expects a table")
         state.pushpyfunction(BUILTIN.lua_next)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from array import array
+from typing import TYPE_CHECKING, Iterator, TextIO
 
 from lua_instruction import Instruction
 
@@ -9,6 +10,8 @@ if TYPE_CHECKING:
 
 
 class LocalVar:
+    __slots__ = ('name', 'startpc', 'endpc')
+
     name: str
     startpc: int
     endpc: int
@@ -18,94 +21,134 @@ class LocalVar:
 
 
 class Debug:
-    lineinfos: list[int]
+    __slots__ = ('lineinfos', 'locvars', 'upvalues')
+
+    lineinfos: array  # source line of each pc, uint32 each
     locvars: list[LocalVar]
     upvalues: list[str]
 
-    def __str__(self) -> str:
-        parts = []
-        parts.append(f'locals ({len(self.locvars)}):')
-        parts.extend(f"\t{i}\t{value}" for i, value in enumerate(self.locvars))
+    def line_for_pc(self, pc: int) -> int:
+        """Source line of the instruction at pc, or 0 if the chunk was stripped of line info."""
+        return self.lineinfos[pc] if pc < len(self.lineinfos) else 0
 
-        parts.append(f'upvalues ({len(self.upvalues)}):')
-        parts.extend(f"\t{i}\t{value}" for i, value in enumerate(self.upvalues))
+    def iter_lines(self) -> Iterator[str]:
+        yield f'locals ({len(self.locvars)}):'
+        for i, value in enumerate(self.locvars):
+            yield f"\t{i}\t{value}"
 
-        return '\n'.join(parts)
+        yield f'upvalues ({len(self.upvalues)}):'
+        for i, value in enumerate(self.upvalues):
+            yield f"\t{i}\t{value}"
+
+    def __str__(self) -> str:
+        return '\n'.join(self.iter_lines())
 
 
 class Proto:
+    __slots__ = ('source', 'type', 'linedefined', 'lastlinedefined', 'nups', 'numparams',
+                 'is_vararg', 'maxstacksize', 'words', 'codes', 'consts', 'protos', 'debug')
+
     source: str
-    type: str = "main"
+    type: str  # "main" or "function"
     linedefined: int
     lastlinedefined: int
     nups: int
     numparams: int
     is_vararg: bool
     maxstacksize: int
-    codes: list[Instruction]
+    words: array  # raw instruction words, uint32 each
+    codes: list[Instruction]  # the same instructions decoded for the VM
     consts: list[Value]
     protos: list[Proto]
     debug: Debug
 
-    def __str__(self) -> str:
-        parts = []
-        parts.append(f"{self.type} <{self.source}:{self.linedefined},{self.lastlinedefined}> ({len(self.codes)} instructions)")
-        parts.append(f"{self.numparams} params, {self.maxstacksize} slots, {len(self.debug.upvalues)} upvalues, \
-                     {len(self.debug.locvars)} locals, {len(self.consts)} constants, {len(self.protos)} functions")
-        parts.extend(f"\t{pc + 1}\t{code}" for pc, code in enumerate(self.codes))
-        parts.append(f'constants ({len(self.consts)}):')
-        parts.extend(f"\t{i + 1}\t{value}" for i, value in enumerate(self.consts))
-        parts.append(str(self.debug))
-        parts.extend(str(sub) for sub in self.protos)
+    def iter_lines(self) -> Iterator[str]:
+        """Yield the listing line by line, passing sub-protos' lines straight through."""
+        yield ''
+        yield f"{self.type} <{self.source}:{self.linedefined},{self.lastlinedefined}> ({len(self.codes)} instructions)"
+        yield f"{self.numparams} params, {self.maxstacksize} slots, {len(self.debug.upvalues)} upvalues, \
+                     {len(self.debug.locvars)} locals, {len(self.consts)} constants, {len(self.protos)} functions"
+        for pc, code in enumerate(self.codes):
+            code.update_info(pc, self.consts, self.debug.upvalues)
+            yield f"\t{pc + 1}\t{code}"
+        yield f'constants ({len(self.consts)}):'
+        for i, value in enumerate(self.consts):
+            yield f"\t{i + 1}\t{value}"
+        yield from self.debug.iter_lines()
+        for sub in self.protos:
+            yield from sub.iter_lines()
+
+    def dump(self, out: TextIO):
+        """Write the listing to out a line at a time, each line newline-terminated."""
+        out.writelines(f'{line}\n' for line in self.iter_lines())
 
-        return '\n' + '\n'.join(parts)
+    def __str__(self) -> str:
+        return '\n'.join(self.iter_lines())
 
 
 class Closure:
-    stack: list[Value]
+    __slots__ = ('upvalues',)
+
     upvalues: list[Value]
 
 
 class LClosure(Closure):
-    varargs: list[Value]
+    __slots__ = ('func',)
+
     func: Proto
-    nrets: int  # number of expected return values
-    ret_idx: int
-    pc: int
 
     def __init__(self, func: Proto):
-        from lua_value import Value
-        self.stack = [Value()] * func.maxstacksize
-        self.upvalues = [Value()] * func.nups  # Initialize upvalues based on function prototype
-        self.varargs = []
+        from lua_value import NIL
+        self.upvalues = [NIL] * func.nups  # Initialize upvalues based on function prototype
         self.func = func
-        self.nrets = 0
-        self.pc = 0
 
     @classmethod
     def from_proto(cls, func: Proto):
         return cls(func)
 
-    def fetch(self) -> Instruction | None:
-        if self.pc >= len(self.func.codes):
-            return None
-        instrution = self.func.codes[self.pc]
-        self.pc += 1
-        return instrution
-
-    # debug
-    def print_stack(self):
-        pass
-
 
 class PClosure(Closure):
+    __slots__ = ('func',)
+
     func: callable
 
     def __init__(self, func: callable):
         self.func = func
-        self.stack = []
         self.upvalues = []
 
     @classmethod
     def from_function(cls, func: callable):
         return cls(func)
+
+
+class CallInfo:
+    """One active call. Its registers live in the state's shared stack from `base` up."""
+    __slots__ = ('closure', 'func', 'base', 'pc', 'varargs', 'nrets', 'ret_idx')
+
+    closure: LClosure | PClosure
+    func: Proto | callable
+    base: int
+    pc: int
+    varargs: list[Value]
+    nrets: int  # number of expected return values
+    ret_idx: int  # absolute stack slot that receives the first result
+
+    def __init__(self, closure: LClosure | PClosure, base: int, ret_idx: int = 0, nrets: int = 0):
+        self.closure = closure
+        self.func = closure.func
+        self.base = base
+        self.pc = 0
+        self.varargs = []
+        self.nrets = nrets
+        self.ret_idx = ret_idx
+
+    def fetch(self) -> Instruction | None:
+        if self.pc >= len(self.func.codes):
+            return None
+        instrution = self.func.codes[self.pc]
+        self.pc += 1
+        return instrution
+
+    # debug
+    def print_stack(self):
+        pass
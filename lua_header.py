@@ -2,6 +2,9 @@ from __future__ import annotations
 
 
 class Header:
+    __slots__ = ('signature', 'version', 'format', 'endianness', 'int_len', 'size_len',
+                 'inst_len', 'number_len', 'number_is_int')
+
     signature: bytes
     version: int
     format: int
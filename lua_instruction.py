@@ -14,9 +14,19 @@ OpArgK = 3  # argument is a constant or register/constant
 # Instruction formats: iABC, iABx, iAsBx
 iABC, iABx, iAsBx = 0, 1, 2
 
+# Field positions and masks within an instruction word (lopcodes.h)
+POS_OP, MASK_OP = 0, 0x3F       # bits 0-5
+POS_A, MASK_A = 6, 0xFF         # bits 6-13
+POS_C, MASK_C = 14, 0x1FF       # bits 14-22
+POS_B, MASK_B = 23, 0x1FF       # bits 23-31
+POS_BX, MASK_BX = 14, 0x3FFFF   # bits 14-31
+MAXARG_SBX = MASK_BX >> 1       # sBx is Bx with this bias
+
 
 class OpCode:
     """Lua 5.1 opcode definition with mode information."""
+    __slots__ = ('name', 'testflag', 'setareg', 'argb', 'argc', 'mode')
+
     def __init__(self, name: str, testflag: int, setareg: int, argb: int, argc: int, mode: int):
         self.name = name
         self.testflag = testflag  # operator is a test (next instruction must be a jump)
@@ -69,16 +79,38 @@ OPCODES = [
     OpCode("VARARG",    0, 1, OpArgU, OpArgN, iABC),
 ]
 
+# Opcode numbers, in OPCODES order; names are only needed for disassembly
+(OP_MOVE, OP_LOADK, OP_LOADBOOL, OP_LOADNIL, OP_GETUPVAL, OP_GETGLOBAL, OP_GETTABLE,
+ OP_SETGLOBAL, OP_SETUPVAL, OP_SETTABLE, OP_NEWTABLE, OP_SELF, OP_ADD, OP_SUB, OP_MUL,
+ OP_DIV, OP_MOD, OP_POW, OP_UNM, OP_NOT, OP_LEN, OP_CONCAT, OP_JMP, OP_EQ, OP_LT, OP_LE,
+ OP_TEST, OP_TESTSET, OP_CALL, OP_TAILCALL, OP_RETURN, OP_FORLOOP, OP_FORPREP, OP_TFORLOOP,
+ OP_SETLIST, OP_CLOSE, OP_CLOSURE, OP_VARARG) = range(len(OPCODES))
+
+# Load-time superinstruction, dispatched but never disassembled: a run of C register
+# MOVEs from B.. to A.. (the instructions keep their MOVE OpCode for display)
+OP_MOVEN = len(OPCODES)
+
+# Straight-line numeric opcodes a numeric for loop body may consist of to be run fused
+FUSIBLE_OPS = frozenset((OP_MOVE, OP_MOVEN, OP_LOADK, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MOD, OP_POW, OP_UNM))
+
 
 class Instruction:
-    instruction: int
-    _opcode_idx: int
+    __slots__ = ('opcode', '_opcode', 'a', 'b', 'c', 'bx', 'sbx',
+                 'kb', 'kc', 'target_pc', 'skip_pc', 'cond_pcs', 'loop_body', '_args', '_comment')
+
+    opcode: int  # index into OPCODES, or a superinstruction such as OP_MOVEN
     _opcode: OpCode
-    _a: int
-    _b: int
-    _c: int
-    _bx: int
-    _sbx: int
+    a: int
+    b: int
+    c: int
+    bx: int
+    sbx: int
+    kb: Value | None  # constant an RK B operand names, None when it is a register
+    kc: Value | None  # same for C
+    target_pc: int
+    skip_pc: int
+    cond_pcs: tuple[int, int]  # EQ/LT/LE only: next pc indexed by the comparison result
+    loop_body: tuple[Instruction, ...] | None  # FORPREP only: body to run fused, if eligible
     _args: list[int]
     _comment: list[str]
 
@@ -87,13 +119,13 @@ class Instruction:
 
     def abc(self) -> tuple[int, int, int]:
         """Return A, B, C arguments, with None as default for missing values."""
-        return self._a, self._b, self._c
+        return self.a, self.b, self.c
 
     def abx(self) -> tuple[int, int]:
-        return self._a, self._bx
+        return self.a, self.bx
 
     def asbx(self) -> tuple[int, int]:
-        return self._a, self._sbx
+        return self.a, self.sbx
 
     def _append_arg(self, arg_type: int, value: int, constants: list[Value]):
         """Get argument representation based on its type."""
@@ -103,25 +135,98 @@ class Instruction:
                 value = 255 - value
             self._args.append(value)
 
+    def update_consts(self, constants: list[Value]):
+        """Resolve constant RK operands up front so handlers don't test rk >= 256 per execution.
+
+        Values are always truthy, so handlers read an operand as `inst.kb or stack[base + b]`.
+        """
+        if self._opcode.mode != iABC:
+            return
+        if self._opcode.argb == OpArgK and self.b > 255:
+            self.kb = constants[self.b - 256]
+        if self._opcode.argc == OpArgK and self.c > 255:
+            self.kc = constants[self.c - 256]
+
+    def update_target(self, pc: int, codes: list[Instruction]):
+        """Resolve absolute branch targets so jumps don't add offsets at runtime."""
+        if self._opcode.mode == iAsBx:
+            self.target_pc = pc + 1 + self.sbx
+            if self.opcode == OP_FORPREP:
+                self.update_loop_body(pc, codes)
+        elif self._opcode.testflag:
+            self.skip_pc = pc + 2
+            # A test is always followed by a JMP; taking the branch lands on its target
+            if pc + 1 < len(codes):
+                self.target_pc = pc + 2 + codes[pc + 1].sbx
+                if self.opcode in (OP_EQ, OP_LT, OP_LE):
+                    # A is the result that takes the jump, so fold it in here
+                    if self.a:
+                        self.cond_pcs = (self.skip_pc, self.target_pc)
+                    else:
+                        self.cond_pcs = (self.target_pc, self.skip_pc)
+
+    def update_loop_body(self, pc: int, codes: list[Instruction]):
+        """Mark a numeric for loop whose body is straight-line arithmetic so FORPREP can run it whole."""
+        end = self.target_pc
+        if end >= len(codes) or codes[end].opcode != OP_FORLOOP or end + 1 + codes[end].sbx != pc + 1:
+            return
+        body = []
+        i = pc + 1
+        while i < end:
+            code = codes[i]
+            if code.opcode not in FUSIBLE_OPS:
+                return
+            body.append(code)
+            i += code.c if code.opcode == OP_MOVEN else 1
+        if body:
+            self.loop_body = tuple(body)
+
+    def update_superop(self, pc: int, codes: list[Instruction]):
+        """Fold a run of MOVEs over consecutive registers into one MOVEN that copies a slice.
+
+        The MOVEs after the first stay in place, so jumps into the run still work.
+        """
+        if self.opcode != OP_MOVE:
+            return
+        n = 1
+        while pc + n < len(codes):
+            code = codes[pc + n]
+            if code.opcode != OP_MOVE or code.a != self.a + n or code.b != self.b + n:
+                break
+            n += 1
+        # A slice copy reads every source first; stop before a source a previous MOVE overwrote
+        shift = self.a - self.b
+        if 0 < shift < n:
+            n = shift
+        if n > 1:
+            self.opcode = OP_MOVEN
+            self.c = n
+
     def update_info(self, pc, constants: list[Value], upvalues: list[str]):
-        """Update instruction arguments with constant/upvalue info."""
-        self._args.append(self._a)
+        """Update instruction arguments with constant/upvalue info.
+
+        Only needed for disassembly, so it runs when a prototype is printed
+        rather than at load time.
+        """
+        self._args = []
+        self._comment = []
+        self._args.append(self.a)
         
         if self._opcode.mode == iABC:
-            self._append_arg(self._opcode.argb, self._b, constants)
-            self._append_arg(self._opcode.argc, self._c, constants)
+            self._append_arg(self._opcode.argb, self.b, constants)
+            self._append_arg(self._opcode.argc, self.c, constants)
         elif self._opcode.mode == iABx:
-            if self._opcode.name in ["LOADK", "GETGLOBAL", "SETGLOBAL"]:
-                self._comment.append(str(constants[self._bx]))
-                self._args.append(-(self._bx + 1))
+            if self.opcode in (OP_LOADK, OP_GETGLOBAL, OP_SETGLOBAL):
+                self._comment.append(str(constants[self.bx]))
+                self._args.append(-(self.bx + 1))
             else:
-                self._args.append(self._bx)
+                self._args.append(self.bx)
         elif self._opcode.mode == iAsBx:
-            self._args.append(self._sbx)
-            self._comment.append(f"to {self._sbx + pc + 2}")
+            self._args.append(self.sbx)
+            self._comment.append(f"to {self.sbx + pc + 2}")
 
         # Special handling for specific opcodes
-        if self._opcode.name in ["GETUPVAL", "SETUPVAL"]:
+        if self.opcode in (OP_GETUPVAL, OP_SETUPVAL):
             if self._args[1] < len(upvalues):
                 self._comment.append(upvalues[self._args[1]])
 
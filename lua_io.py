@@ -1,36 +1,110 @@
+from __future__ import annotations
+
 import struct
-from typing import BinaryIO
+import sys
+from mmap import mmap
+from array import array
+
+# uint32, uint64, double, then the fixed field runs: a proto's linedefined .. maxstacksize
+# and a local's startpc, endpc. Compiled for each byte order, picked once per chunk.
+_FORMATS = ('I', 'Q', 'd', '2I4B', '2I')
+_LITTLE = tuple(struct.Struct('<' + fmt) for fmt in _FORMATS)
+_BIG = tuple(struct.Struct('>' + fmt) for fmt in _FORMATS)
+
 
 class Reader:
-    def __init__(self, file: BinaryIO):
-        self.file = file
+    """Cursor over a chunk already in memory, so reads are slices rather than syscalls.
+
+    Byte and Struct reads leave bounds to the buffer, so past the end they raise
+    IndexError or struct.error; PyLua turns those into EOFError.
+    """
+    __slots__ = ('buf', 'pos', '_strings', '_swap', '_u32', '_u64', '_f64', 'proto_info', 'locvar_range')
+
+    def __init__(self, buf: bytes | mmap):
+        self.buf = buf
+        self.pos = 0
+        # Sources, names and string constants repeat across protos; decode each once
+        self._strings: dict[bytes, str] = {}
+        self.set_endianness(sys.byteorder == 'little')
+
+    def set_endianness(self, little: bool):
+        """Install the Structs for the chunk's byte order, so field reads never branch on it."""
+        self._swap = little != (sys.byteorder == 'little')
+        self._u32, self._u64, self._f64, self.proto_info, self.locvar_range = _LITTLE if little else _BIG
 
     def read_bytes(self, n: int) -> bytes:
-        data = self.file.read(n)
-        if len(data) != n:
+        pos = self.pos
+        end = pos + n
+        if end > len(self.buf):
             raise EOFError("Unexpected end of file")
-        return data
+        self.pos = end
+        return self.buf[pos:end]
+
+    def read_raw(self, n: int) -> memoryview:
+        """Like read_bytes, but a view into the buffer instead of a copy; release it when done."""
+        pos = self.pos
+        end = pos + n
+        if end > len(self.buf):
+            raise EOFError("Unexpected end of file")
+        self.pos = end
+        return memoryview(self.buf)[pos:end]
     
     def read_uint8(self) -> int:
         """Read a single unsigned byte."""
-        return struct.unpack('B', self.read_bytes(1))[0]
+        pos = self.pos
+        value = self.buf[pos]  # indexing bytes or an mmap gives the int directly
+        self.pos = pos + 1
+        return value
     
     def read_uint32(self) -> int:
         """Read an unsigned 32-bit integer."""
-        return struct.unpack('I', self.read_bytes(4))[0]
+        pos = self.pos
+        value = self._u32.unpack_from(self.buf, pos)[0]
+        self.pos = pos + 4
+        return value
     
     def read_uint64(self) -> int:
         """Read an unsigned 64-bit integer."""
-        return struct.unpack('Q', self.read_bytes(8))[0]
+        pos = self.pos
+        value = self._u64.unpack_from(self.buf, pos)[0]
+        self.pos = pos + 8
+        return value
     
+    def read_uint32_array(self, n: int) -> array:
+        """Read n unsigned 32-bit integers straight into a contiguous array."""
+        words = array('I')
+        with self.read_raw(words.itemsize * n) as raw:
+            words.frombytes(raw)
+        if self._swap:
+            words.byteswap()
+        return words
+
+    def read_struct(self, fmt: struct.Struct) -> tuple:
+        """Read a run of fixed-size fields with one precompiled Struct."""
+        pos = self.pos
+        values = fmt.unpack_from(self.buf, pos)
+        self.pos = pos + fmt.size
+        return values
+
     def read_double(self) -> float:
         """Read a double-precision float."""
-        return struct.unpack('d', self.read_bytes(8))[0]
+        pos = self.pos
+        value = self._f64.unpack_from(self.buf, pos)[0]
+        self.pos = pos + 8
+        return value
         
     def read_string(self) -> str:
         length = self.read_uint64()
         if length == 0:
             return ""
-        string_bytes = self.read_bytes(length - 1)  # Exclude null terminator
-        self.read_bytes(1)  # Read and discard null terminator
-        return string_bytes.decode('utf-8')
\ No newline at end of file
+        # Slice the body and step over the null terminator, rather than slicing it off a copy
+        pos = self.pos
+        end = pos + length
+        if end > len(self.buf):
+            raise EOFError("Unexpected end of file")
+        raw = self.buf[pos:end - 1]
+        self.pos = end
+        string = self._strings.get(raw)
+        if string is None:
+            string = self._strings[raw] = sys.intern(raw.decode('utf-8'))
+        return string
\ No newline at end of file
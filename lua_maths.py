@@ -1,17 +1,20 @@
+import operator
+
+# name: (function, arity)
 ARITHS = {
-    'ADD': lambda a, b: a + b,
-    'SUB': lambda a, b: a - b,
-    'MUL': lambda a, b: a * b,
-    'DIV': lambda a, b: a / b,
-    'MOD': lambda a, b: a % b,
-    'POW': lambda a, b: a ** b,
+    'ADD': (operator.add, 2),
+    'SUB': (operator.sub, 2),
+    'MUL': (operator.mul, 2),
+    'DIV': (operator.truediv, 2),
+    'MOD': (operator.mod, 2),
+    'POW': (operator.pow, 2),
 
-    'UNM': lambda a: -a,
-    'BNOT': lambda a: ~a,
+    'UNM': (operator.neg, 1),
+    'BNOT': (operator.invert, 1),
 }
 
 COMPARE = {
     'EQ': lambda a, b: a == b,
     'LT': lambda a, b: a < b,
     'LE': lambda a, b: a <= b,
-}
\ No newline at end of file
+}
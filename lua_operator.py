@@ -3,10 +3,11 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Optional
 
-from lua_instruction import Instruction
-from lua_value import Value
+from lua_instruction import Instruction, OPCODES, OP_MOVEN, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MOD, OP_POW
+from lua_value import Value, NIL
 from lua_table import Table
 from lua_function import LClosure
+from lua_maths import ARITHS, COMPARE
 
 if TYPE_CHECKING:
     from lua_state import LuaState
@@ -14,6 +15,8 @@ if TYPE_CHECKING:
 class CheckNumber:
     @staticmethod
     def check(val: Value) -> bool:
+        if type(val.value) in _NUMBER_TYPES:
+            return True
         val.conv_str_to_number()
         if val.is_number():
             return True
@@ -33,324 +36,366 @@ class CompareCheck:
         return False
 
 
+_NUMBER_TYPES = (int, float)
+
+
+def _concat_str(val: Value) -> str:
+    """String form of a CONCAT operand; non-string/number operands contribute nothing."""
+    if type(val.value) is str:
+        return val.value
+    string = val.get_string()
+    return string if string is not None else ""
+
+
+def _concat(values: list[Value]) -> str:
+    """Join CONCAT operands; all-string runs go straight to str.join without per-operand calls."""
+    try:
+        return ''.join([val.value for val in values])
+    except TypeError:
+        return ''.join(map(_concat_str, values))
+
+
 class ArithOperator:
     op: callable
+    arity: int
     check: CheckNumber
     meta: str
 
-    def __init__(self, op: callable, check: CheckNumber, meta: str):
+    def __init__(self, op: callable, arity: int, check: CheckNumber, meta: str):
         self.op = op
+        self.arity = arity
         self.meta = meta
         self.check = check
 
-    def solve(self, L: LuaState, a: int, b: Optional[int] = None) -> Value | bool:
-        va = L._get_rk(a)
+    def solve(self, L: LuaState, va: Value, vb: Optional[Value] = None) -> Value | bool:
         mt = va.get_metatable()
-        if b is None:
+        if self.arity == 1:
             if self.check.check(va) is not None:
                 return Value.number(self.op(va.value))
             else:
                 if mt:
-                    meta_func = mt.get(Value.string(self.meta))
+                    meta_func = mt.get_raw(self.meta)
                     if meta_func and meta_func.is_function():
                         return L._luacall(meta_func.value, va)
         else:
-            vb = L._get_rk(b)
             if self.check.checks(va, vb):
                 return Value.number(self.op(va.value, vb.value))
             else:
                 if mt is None:
                     mt = vb.get_metatable()
                 if mt:
-                    meta_func = mt.get(Value.string(self.meta))
+                    meta_func = mt.get_raw(self.meta)
                     if meta_func and meta_func.is_function():
                         return L._luacall(meta_func.value, va, vb)
         return False
 
-    def arith(self, L: LuaState, idx: int, a: int, b: Optional[int] = None):
-        res = self.solve(L, a, b)
+    def arith(self, L: LuaState, idx: int, va: Value, vb: Optional[Value] = None):
+        # Plain numbers need neither coercion nor a metamethod lookup
+        a = va.value
+        if type(a) in _NUMBER_TYPES:
+            if self.arity == 1:
+                L.stack[L.base + idx] = Value.number(self.op(a))
+                return
+            b = vb.value
+            if type(b) in _NUMBER_TYPES:
+                L.stack[L.base + idx] = Value.number(self.op(a, b))
+                return
+
+        res = self.solve(L, va, vb)
         if res:
-            L.stack[idx] = res
+            L.stack[L.base + idx] = res
         else:
             raise TypeError("arithmetic error")
 
-    def compare(self, L: LuaState, a: int, b: int) -> bool:
-        res = self.solve(L, a, b)
+    def compare(self, L: LuaState, va: Value, vb: Value) -> bool:
+        res = self.solve(L, va, vb)
         if type(res) is Value and res.is_boolean():
             return res.value
         return False
 
 
-ARITH = {
-    "ADD": ArithOperator(lambda a, b: a + b , CheckNumber, "__add"),
-    "SUB": ArithOperator(lambda a, b: a - b , CheckNumber, "__sub"),
-    "MUL": ArithOperator(lambda a, b: a * b , CheckNumber, "__mul"),
-    "DIV": ArithOperator(lambda a, b: a / b , CheckNumber, "__div"),
-    "MOD": ArithOperator(lambda a, b: a % b , CheckNumber, "__mod"),
-    "POW": ArithOperator(lambda a, b: a ** b, CheckNumber, "__pow"),
-    "UNM": ArithOperator(lambda a: -a       , CheckNumber, "__unm"),
-    "BNOT": ArithOperator(lambda a: ~a      , CheckNumber, "__bnot"),
-
-    "EQ": ArithOperator(lambda a, b: a == b , CompareCheck, "__eq"),
-    "LT": ArithOperator(lambda a, b: a < b  , CompareCheck, "__lt"),
-    "LE": ArithOperator(lambda a, b: a <= b , CompareCheck, "__le"),
-}
+ARITH = {name: ArithOperator(op, arity, CheckNumber, f"__{name.lower()}")
+         for name, (op, arity) in ARITHS.items()}
+ARITH.update((name, ArithOperator(op, 2, CompareCheck, f"__{name.lower()}"))
+             for name, op in COMPARE.items())
 
 
 class Operator:
     @staticmethod
     def MOVE(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        state.stack[a] = state.stack[b]
+        a, b = inst.a, inst.b
+        base = state.base
+        state.stack[base + a] = state.stack[base + b]
+
+    @staticmethod
+    def MOVEN(inst: Instruction, state: LuaState):
+        a, b, n = inst.a, inst.b, inst.c
+        base = state.base
+        state.stack[base + a:base + a + n] = state.stack[base + b:base + b + n]
+        state.call_info[-1].pc += n - 1
 
     @staticmethod
     def LOADK(inst: Instruction, state: LuaState):
-        a, bx = inst.abx()
-        state.stack[a] = state.func.consts[bx]
+        a, bx = inst.a, inst.bx
+        state.stack[state.base + a] = state.func.consts[bx]
 
     @staticmethod
     def LOADBOOL(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        state.stack[a] = Value.boolean(bool(b))
+        a, b, c = inst.a, inst.b, inst.c
+        state.stack[state.base + a] = Value.boolean(bool(b))
         if c != 0:
             state.call_info[-1].pc += 1
 
     @staticmethod
     def LOADNIL(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        for i in range(a, b + 1):
-            state.stack[i] = Value.nil()
+        a, b = inst.a, inst.b
+        base = state.base
+        state.stack[base + a:base + b + 1] = [NIL] * (b - a + 1)
 
     @staticmethod
     def GETUPVAL(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        closure = state.call_info[-1]
+        a, b = inst.a, inst.b
+        closure = state.call_info[-1].closure
         if b < len(closure.upvalues):
-            state.stack[a] = closure.upvalues[b]
+            state.stack[state.base + a] = closure.upvalues[b]
         else:
-            state.stack[a] = Value.nil()
+            state.stack[state.base + a] = NIL
 
     @staticmethod
     def GETGLOBAL(inst: Instruction, state: LuaState):
-        a, bx = inst.abx()
-        name = state.func.consts[bx].value
-        state.stack[a] = state.get_global(name)
+        a, bx = inst.a, inst.bx
+        value = state.globals.get_raw(state.func.consts[bx].value)
+        state.stack[state.base + a] = value if value is not None else NIL
 
     @staticmethod
     def GETTABLE(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        table_value = state.stack[b]
-        key = state._get_rk(c)
+        a, b, c = inst.a, inst.b, inst.c
+        base = state.base
+        stack = state.stack
+        table_value = stack[base + b]
+        key = inst.kc or stack[base + c]
         if table_value.is_table():
             result = state.gettable(b, key)
-            state.stack[a] = result if result is not None else Value.nil()
+            stack[base + a] = result if result is not None else NIL
         else:
-            state.stack[a] = Value.nil()
+            stack[base + a] = NIL
 
     @staticmethod
     def SETGLOBAL(inst: Instruction, state: LuaState):
-        a, bx = inst.abx()
-        name = state.func.consts[bx].value
-        state.set_global(name, state.stack[a])
+        a, bx = inst.a, inst.bx
+        state.globals.set_raw(state.func.consts[bx].value, state.stack[state.base + a])
 
     @staticmethod
     def SETUPVAL(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        closure = state.call_info[-1]
+        a, b = inst.a, inst.b
+        closure = state.call_info[-1].closure
         if b < len(closure.upvalues):
-            closure.upvalues[b] = state.stack[a]
+            closure.upvalues[b] = state.stack[state.base + a]
 
     @staticmethod
     def SETTABLE(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        table_value = state.stack[a]
-        key = state._get_rk(b)
-        value = state._get_rk(c)
+        a, b, c = inst.a, inst.b, inst.c
+        base = state.base
+        stack = state.stack
+        table_value = stack[base + a]
+        key = inst.kb or stack[base + b]
+        value = inst.kc or stack[base + c]
         if table_value.is_table():
             table_value.value.set(key, value)
 
     @staticmethod
     def NEWTABLE(inst: Instruction, state: LuaState):
-        a, _, _ = inst.abc()
-        state.stack[a] = Value.table(Table())
+        a = inst.a
+        state.stack[state.base + a] = Value.table(Table())
 
     @staticmethod
     def SELF(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        state.stack[a + 1] = state.stack[b]
-        key = state._get_rk(c)
+        a, b, c = inst.a, inst.b, inst.c
+        base = state.base
+        stack = state.stack
+        stack[base + a + 1] = stack[base + b]
+        key = inst.kc or stack[base + c]
         result = state.gettable(b, key)
-        state.stack[a] = result if result is not None else Value.nil()
-
-    @staticmethod
-    def ADD(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        ARITH["ADD"].arith(state, a, b, c)
-
-    @staticmethod
-    def SUB(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        ARITH["SUB"].arith(state, a, b, c)
-
-    @staticmethod
-    def MUL(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        ARITH["MUL"].arith(state, a, b, c)
-
-    @staticmethod
-    def DIV(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        ARITH["DIV"].arith(state, a, b, c)
-
-    @staticmethod
-    def MOD(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        ARITH["MOD"].arith(state, a, b, c)
-
-    @staticmethod
-    def POW(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        ARITH["POW"].arith(state, a, b, c)
+        stack[base + a] = result if result is not None else NIL
 
     @staticmethod
     def UNM(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        ARITH["UNM"].arith(state, a, b)
+        a, b = inst.a, inst.b
+        ARITH["UNM"].arith(state, a, state.stack[state.base + b])
 
     @staticmethod
     def NOT(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        state.stack[a] = Value.boolean(not state.stack[b].get_boolean())
+        a, b = inst.a, inst.b
+        base = state.base
+        state.stack[base + a] = Value.boolean(not state.stack[base + b].get_boolean())
 
     @staticmethod
     def LEN(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        state.stack[a] = Value.number(state.len(b))
+        a, b = inst.a, inst.b
+        state.stack[state.base + a] = Value.number(state.len(b))
 
     @staticmethod
     def CONCAT(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        result = ""
-        for i in range(b, c + 1):
-            val = state.stack[i]
-            val.conv_number_to_str()
-            if val.is_string():
-                result += val.value
-        state.stack[a] = Value.string(result)
+        a, b, c = inst.a, inst.b, inst.c
+        base = state.base
+        stack = state.stack
+        stack[base + a] = Value.string(_concat(stack[base + b:base + c + 1]))
 
     @staticmethod
     def JMP(inst: Instruction, state: LuaState):
-        _, sbx = inst.asbx()
-        state.jump(sbx)
+        state.call_info[-1].pc = inst.target_pc
 
     @staticmethod
     def EQ(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        if ARITH["EQ"].compare(state, b, c) == (a != 0):
-            inst = state.fetch(); assert inst.op_name() == "JMP"
-            Operator.JMP(inst, state)
+        b, c = inst.b, inst.c
+        base = state.base
+        rb = inst.kb or state.stack[base + b]
+        rc = inst.kc or state.stack[base + c]
+        vb = rb.value
+        vc = rc.value
+        if type(vb) in _NUMBER_TYPES and type(vc) in _NUMBER_TYPES:
+            cond = vb == vc
         else:
-            state.call_info[-1].pc += 1
+            cond = ARITH["EQ"].compare(state, rb, rc)
+        state.call_info[-1].pc = inst.cond_pcs[cond]
 
     @staticmethod
     def LT(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        if ARITH["LT"].compare(state, b, c) == (a != 0):
-            inst = state.fetch(); assert inst.op_name() == "JMP"
-            Operator.JMP(inst, state)
+        b, c = inst.b, inst.c
+        base = state.base
+        rb = inst.kb or state.stack[base + b]
+        rc = inst.kc or state.stack[base + c]
+        vb = rb.value
+        vc = rc.value
+        if type(vb) in _NUMBER_TYPES and type(vc) in _NUMBER_TYPES:
+            cond = vb < vc
         else:
-            state.call_info[-1].pc += 1
+            cond = ARITH["LT"].compare(state, rb, rc)
+        state.call_info[-1].pc = inst.cond_pcs[cond]
 
     @staticmethod
     def LE(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        if ARITH["LE"].compare(state, b, c) == (a != 0):
-            inst = state.fetch(); assert inst.op_name() == "JMP"
-            Operator.JMP(inst, state)
+        b, c = inst.b, inst.c
+        base = state.base
+        rb = inst.kb or state.stack[base + b]
+        rc = inst.kc or state.stack[base + c]
+        vb = rb.value
+        vc = rc.value
+        if type(vb) in _NUMBER_TYPES and type(vc) in _NUMBER_TYPES:
+            cond = vb <= vc
         else:
-            state.call_info[-1].pc += 1
+            cond = ARITH["LE"].compare(state, rb, rc)
+        state.call_info[-1].pc = inst.cond_pcs[cond]
 
     @staticmethod
     def TEST(inst: Instruction, state: LuaState):
-        a, _, c = inst.abc()
-        if state.stack[a].get_boolean() == (c != 0):
-            state.call_info[-1].pc += 1
+        a, c = inst.a, inst.c
+        if state.stack[state.base + a].get_boolean() == (c != 0):
+            state.call_info[-1].pc = inst.target_pc
         else:
-            state.jump(1)
+            state.call_info[-1].pc = inst.skip_pc
 
     @staticmethod
     def TESTSET(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        if state.stack[b].get_boolean() == (c != 0):
-            state.call_info[-1].pc += 1
+        a, b, c = inst.a, inst.b, inst.c
+        base = state.base
+        stack = state.stack
+        if stack[base + b].get_boolean() == (c != 0):
+            stack[base + a] = stack[base + b]
+            state.call_info[-1].pc = inst.target_pc
         else:
-            state.stack[a] = state.stack[b]
-            state.jump(1)
+            state.call_info[-1].pc = inst.skip_pc
 
     @staticmethod
     def CALL(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        nargs = b - 1 if b != 0 else len(state.stack) - a - 1
+        a, b, c = inst.a, inst.b, inst.c
+        nargs = b - 1 if b != 0 else state.top - state.base - a - 1
         nrets = c - 1
         state.call(a, nargs, nrets)
 
     @staticmethod
     def TAILCALL(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        nargs = b - 1 if b != 0 else len(state.stack) - a - 1
+        a, b = inst.a, inst.b
+        nargs = b - 1 if b != 0 else state.top - state.base - a - 1
         state.call(a, nargs, -1)
 
     @staticmethod
     def RETURN(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        ret_count = b - 1 if b != 0 else len(state.stack) - a
+        a, b = inst.a, inst.b
+        ret_count = b - 1 if b != 0 else state.top - state.base - a
         state.poscall(a, ret_count)
 
     @staticmethod
     def FORLOOP(inst: Instruction, state: LuaState):
-        a, sbx = inst.asbx()
-        step = state.stack[a + 2]
-        idx = state.stack[a]
-        idx.value += step.value
-        limit = state.stack[a + 1]
+        a = inst.a
+        a += state.base
+        stack = state.stack
+        step = stack[a + 2].value
+        idx = Value.number(stack[a].value + step)
+        limit = stack[a + 1].value
+        stack[a] = idx
         
-        if (step.value > 0 and idx.value <= limit.value) or \
-           (step.value <= 0 and idx.value >= limit.value):
-            state.jump(sbx)
-            state.stack[a + 3] = idx
+        if (step > 0 and idx.value <= limit) or \
+           (step <= 0 and idx.value >= limit):
+            state.call_info[-1].pc = inst.target_pc
+            stack[a + 3] = idx
 
     @staticmethod
     def FORPREP(inst: Instruction, state: LuaState):
-        a, sbx = inst.asbx()
-        init = state.stack[a]
-        step = state.stack[a + 2]
-        init.value -= step.value
-        state.jump(sbx)
+        a = inst.a
+        a += state.base
+        stack = state.stack
+        stack[a] = Value.number(stack[a].value - stack[a + 2].value)
+        if inst.loop_body is None:
+            state.call_info[-1].pc = inst.target_pc
+            return
+
+        # Straight-line body: iterate here rather than dispatching FORLOOP every pass
+        body = tuple((DISPATCH[code.opcode], code) for code in inst.loop_body)
+        idx = stack[a].value
+        limit = stack[a + 1].value
+        step = stack[a + 2].value
+        while True:
+            idx += step
+            if (step > 0 and idx > limit) or (step <= 0 and idx < limit):
+                break
+            stack[a + 3] = Value.number(idx)
+            for handler, code in body:
+                handler(code, state)
+        stack[a] = Value.number(idx)
+        state.call_info[-1].pc = inst.target_pc + 1
 
     @staticmethod
     def TFORLOOP(inst: Instruction, state: LuaState):
-        a, _, c = inst.abc()
-        state.stack[a + 3] = state.stack[a]
-        state.stack[a + 4] = state.stack[a + 1]
-        state.stack[a + 5] = state.stack[a + 2]
+        a, c = inst.a, inst.c
+        stack = state.stack
+        ra = state.base + a
+        stack[ra + 3] = stack[ra]
+        stack[ra + 4] = stack[ra + 1]
+        stack[ra + 5] = stack[ra + 2]
         state.call(a + 3, 2, c)
-        if not state.stack[a + 3].is_nil():
-            state.stack[a + 2] = state.stack[a + 3]
+        a = ra
+        if not stack[a + 3].is_nil():
+            stack[a + 2] = stack[a + 3]
         else:
             state.jump(1)
 
     @staticmethod
     def SETLIST(inst: Instruction, state: LuaState):
-        a, b, c = inst.abc()
-        table = state.stack[a]
+        a, b, c = inst.a, inst.b, inst.c
+        a += state.base
+        stack = state.stack
+        table = stack[a]
         if not table.is_table():
             raise TypeError("SETLIST expects a table")
         
-        n = b if b != 0 else len(state.stack) - a - 1
+        n = b if b != 0 else state.top - a - 1
         base = (c - 1) * 50
         
         for i in range(1, n + 1):
-            table.value.set(base + i, state.stack[a + i])
+            table.value.set_raw(base + i, stack[a + i])
+        if b == 0:
+            state.top = state.base + state.func.maxstacksize
 
     @staticmethod
     def CLOSE(inst: Instruction, state: LuaState):
@@ -358,18 +403,47 @@ class Operator:
 
     @staticmethod
     def CLOSURE(inst: Instruction, state: LuaState):
-        a, bx = inst.abx()
+        a, bx = inst.a, inst.bx
         proto = state.func.protos[bx]
         closure = LClosure.from_proto(proto)
-        state.stack[a] = Value.closure(closure)
+        state.stack[state.base + a] = Value.closure(closure)
 
     @staticmethod
     def VARARG(inst: Instruction, state: LuaState):
-        a, b, _ = inst.abc()
-        closure = state.call_info[-1]
-        n = b - 1 if b != 0 else len(closure.varargs)
-        for i in range(n):
-            if i < len(closure.varargs):
-                state.stack[a + i] = closure.varargs[i]
-            else:
-                state.stack[a + i] = Value.nil()
+        a, b = inst.a, inst.b
+        a += state.base
+        stack = state.stack
+        varargs = state.call_info[-1].varargs
+        n = b - 1
+        if b == 0:
+            n = len(varargs)
+            state.check_stack(a + n)
+            state.top = a + n
+        values = varargs[:n]
+        if len(values) < n:
+            values.extend([NIL] * (n - len(values)))
+        stack[a:a + n] = values
+
+
+def _nop(inst: Instruction, state: LuaState):
+    pass
+
+
+def _binary_arith(arith: ArithOperator):
+    """Build the ADD/SUB/MUL/DIV/MOD/POW handler for one operator."""
+    def handler(inst: Instruction, state: LuaState):
+        base = state.base
+        stack = state.stack
+        arith.arith(state, inst.a, inst.kb or stack[base + inst.b], inst.kc or stack[base + inst.c])
+    return handler
+
+
+_BINARY_ARITH_OPS = (OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MOD, OP_POW)
+
+# Handlers indexed by opcode number; opcodes without a handler do nothing
+DISPATCH = tuple(_binary_arith(ARITH[op.name]) if i in _BINARY_ARITH_OPS
+                 else getattr(Operator, op.name, _nop)
+                 for i, op in enumerate(OPCODES))
+# Superinstructions are numbered after the real opcodes, in order
+assert len(DISPATCH) == OP_MOVEN
+DISPATCH += (Operator.MOVEN,)
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
 from typing import Optional
-from lua_operator import Operator
-from lua_instruction import Instruction
-from lua_value import Value
+from lua_operator import DISPATCH
+from lua_instruction import Instruction, OP_MOVE, OP_MOVEN, OP_LOADK, OP_JMP, OP_FORLOOP, OP_RETURN
+from lua_value import Value, NIL
 from lua_table import Table
-from lua_function import LClosure, PClosure, Proto
+from lua_function import LClosure, PClosure, Proto, CallInfo
 from lua_builtins import BUILTIN
 
 LUA_REGISTRY_INDEX = -10000
@@ -19,11 +19,19 @@ LUA_ERRSYNTAX = 3
 LUA_ERRMEM = 4
 LUA_ERRERR = 5
 
+_GLOBALS_REGKEY = Value.number(LUA_GLOBALS_INDEX)
+
 
 class LuaState:
-    call_info: list[LClosure | PClosure]
+    __slots__ = ('call_info', 'func', 'stack', 'base', 'top', 'registry', 'globals', 'mt')
+
+    call_info: list[CallInfo]
     func: Proto
-    stack: list[Value]
+    stack: list[Value]  # shared by every frame; each CallInfo owns the slots from its base
+    base: int
+    top: int  # first free slot; the buffer past it is spare capacity
+
+    trace: bool = False  # print each executed instruction and the frame's registers
     registry: Table
     globals: Table
 
@@ -31,15 +39,16 @@ class LuaState:
     mt: Table
 
     def __init__(self, main: Proto):
-        self.call_info = [LClosure.from_proto(main)]  # Pass Value as factory
+        self.call_info = [CallInfo(LClosure.from_proto(main), 0)]
+        self.stack = [NIL] * main.maxstacksize
+        self.top = main.maxstacksize
         self.registry = Table()
-        key = Value.number(LUA_GLOBALS_INDEX)
-        self.registry.set(key, Value.table(Table()))
-        self.globals = self.registry.get(key).value
+        self.registry.set(_GLOBALS_REGKEY, Value.table(Table()))
+        self.globals = self.registry.get(_GLOBALS_REGKEY).value
         self.mt = Table()
 
-        self.func = self.call_info[-1].func
-        self.stack = self.call_info[-1].stack
+        self.func = main
+        self.base = 0
 
         # Register built-in functions
         self.register("print", BUILTIN.lua_print)
@@ -52,120 +61,125 @@ class LuaState:
         self.register("pcall", BUILTIN.lua_pcall)
 
     def get_global(self, name: str) -> Value:
-        key = Value.string(name)
-        value = self.globals.get(key)
-        return value if value is not None else Value.nil()
+        value = self.globals.get_raw(name)
+        return value if value is not None else NIL
 
     def set_global(self, name: str, value: Value):
-        key = Value.string(name)
-        self.globals.set(key, value)
+        self.globals.set_raw(name, value)
 
-    def push_closure(self, closure: LClosure | PClosure):
-        self.call_info.append(closure)
-        self.func = self.call_info[-1].func
-        self.stack = self.call_info[-1].stack
+    def push_callinfo(self, frame: CallInfo):
+        self.call_info.append(frame)
+        self.func = frame.func
+        self.base = frame.base
 
-    def pop_closure(self) -> LClosure:
+    def pop_callinfo(self) -> CallInfo:
         frame = self.call_info.pop()
         if len(self.call_info) > 0:
             self.func = self.call_info[-1].func
-            self.stack = self.call_info[-1].stack
+            self.base = self.call_info[-1].base
         return frame
 
     def register(self, name: str, func: callable):
-        self.globals.set(Value.string(name), Value.closure(PClosure(func)))
+        self.set_global(name, Value.closure(PClosure(func)))
 
     def _getmetatable(self, val: Value) -> Value | None:
         if val.is_table() or val.is_userdata():
             mt = val.get_metatable()
             return Value.table(mt) if mt else None
         else:
-            return self.mt.get(Value.string(val.type_name()))
+            return self.mt.get_raw(val.type_name())
+
+    def check_stack(self, size: int):
+        """Grow the stack buffer, at least doubling it, so it holds `size` slots."""
+        n = len(self.stack)
+        if n < size:
+            self.stack.extend([NIL] * max(size - n, n))
 
     # external metamethods
     def pop(self, n: int) -> None:
-        for _ in range(n):
-            self.stack.pop()
+        if n > 0:
+            self.top -= n
 
     def remove(self, idx: int) -> None:
         assert idx != 0, "Index cannot be zero"
-        if idx < 0:
-            self.stack.pop(idx)
-        elif idx > 0:
-            self.stack.pop(idx - 1)
+        pos = self.top + idx if idx < 0 else self.base + idx - 1
+        self.stack[pos:self.top - 1] = self.stack[pos + 1:self.top]
+        self.top -= 1
 
     def gettop(self) -> int:
-        return len(self.stack)
+        return self.top - self.base
 
     def settop(self, idx: int):
-        while len(self.stack) > idx:
-            self.stack.pop()
-        while len(self.stack) < idx:
-            self.stack.append(Value.nil())
+        top = self.base + idx
+        if top > self.top:
+            self.check_stack(top)
+            self.stack[self.top:top] = [NIL] * (top - self.top)
+        self.top = top
 
     def pushstring(self, s: str):
-        self.stack.append(Value.string(s))
+        self.pushvalue(Value.string(s))
 
     def rawget(self, idx: int) -> None:
         t = self._index2adr(idx)
         if not t.is_table():
             raise TypeError("rawget expects a table")
-        key = self.stack[-1]
+        key = self.stack[self.top - 1]
         value = t.value.get(key)
         if value is None:
-            value = Value.nil()
-        self.stack[-1] = value
+            value = NIL
+        self.stack[self.top - 1] = value
 
     def getmetatable(self, idx: int) -> int:
         obj = self._index2adr(idx)
         mt = self._getmetatable(obj)
         if mt is None:
             return 0
-        self.stack.append(mt)
+        self.pushvalue(mt)
         return 1
 
     def setmetatable(self, idx: int) -> None:
         obj = self._index2adr(idx)
-        mt = self.stack[-1]
+        mt = self.stack[self.top - 1]
         assert mt.is_table(), "Metatable must be a table"
         if obj.is_table():
             obj.value.setmetatable(mt.value)
         else:
-            self.mt.set(Value.string(obj.type_name()), mt)
+            self.mt.set_raw(obj.type_name(), mt)
 
     def getmetafield(self, idx: int, field: str) -> int:
         if self.getmetatable(idx) == 0:
             return 0
         self.pushstring(field)
         self.rawget(-2)
-        if self.stack[-1].is_nil():
+        if self.stack[self.top - 1].is_nil():
             self.pop(2)
             return 0
         self.remove(-2)
         return 1
 
     def gettable(self, idx: int, key: Value) -> Value:
-        t = self.stack[idx]
+        t = self.stack[self.base + idx]
         # Delegate to Value's gettable method with callback
         return t.gettable(key, self._luacall)
 
     def len(self, idx: int) -> int:
-        t = self.stack[idx]
+        t = self.stack[self.base + idx]
         # Delegate to Value's len method with callback
         return t.len(self._luacall)
 
     def call(self, idx: int, nargs: int, nrets: int):
-        func_value = self.stack[idx]
-        if func_value.is_function():
-            if type(func_value.value) is LClosure:
-                self.precall(func_value.value, idx, nargs, nrets)
-                while self.excute(): pass
-            else:
-                self.pycall(func_value.value, idx, nargs, nrets)
-        elif func_value.is_table():
+        func_value = self.stack[self.base + idx]
+        func_type = type(func_value.value)
+        if func_type is LClosure:
+            self.precall(func_value.value, idx, nargs, nrets)
+            self.run()
+        elif func_type is PClosure:
+            self.pycall(func_value.value, idx, nargs, nrets)
+        elif func_type is Table:
             mt = func_value.get_metatable()
-            func_value = mt.get(Value("__call")) if mt else None
+            func_value = mt.get_raw("__call") if mt else None
             if func_value and func_value.is_function():
+                idx += self.base
                 self.stack[idx] = self._luacall(func_value.value, *self.stack[idx: idx + nargs + 1])
         else:
             raise TypeError("CALL error")
@@ -176,8 +190,8 @@ class LuaState:
             self.call(idx, nargs, nrets)
         except Exception as e:
             while len(self.call_info) > ci_len:
-                self.pop_closure()
-            self.stack.clear()
+                self.pop_callinfo()
+            self.top = self.base
             self.pushvalue(Value.string(str(e)))
             if e is RuntimeError:
                 return LUA_ERRRUN
@@ -190,100 +204,169 @@ class LuaState:
         return LUA_OK
         
     def error(self):
-        value = self.stack[-1]
+        value = self.stack[self.top - 1]
         raise RuntimeError(value.value)
 
-    def excute(self) -> bool:
-        inst = self.fetch()
-        if inst is None:
-            return False
-        op_name = inst.op_name()
-        method = getattr(Operator, op_name, None)
-        if method:
-            # print(f"-{len(self.call_info)}- " +  str(inst).ljust(40))
-            method(inst, self)
-            # print(f"-{len(self.call_info)}- " +  ''.join(f"[{v}]" for v in self.stack))
-        if op_name == "RETURN":
-            return False
-        return True
-
-    def precall(self, closure: LClosure, func_idx: int = 0, nargs: int = 0, nrets: int = 0):
-        closure.stack = [Value.nil()] * closure.func.maxstacksize
-        closure.pc = 0
-        closure.varargs = []
-        for i in range(nargs):
-            value = self.stack[func_idx + 1 + i]
-            if i < closure.func.numparams:
-                closure.stack[i] = value
+    def run(self):
+        """Execute the current Lua frame until it returns.
+
+        The frame and its code only change across CALL/RETURN; Lua calls run
+        their own nested loop, so the code, constants, register window and pc
+        are all held in locals for the whole frame. pc is written back to the
+        frame only around handlers, which read and redirect it there.
+        """
+        if LuaState.trace:
+            return self._run_traced()
+        frame = self.call_info[-1]
+        codes = frame.func.codes
+        consts = frame.func.consts
+        stack = self.stack  # only ever grown in place, so this reference stays valid
+        base = self.base
+        size = len(codes)
+        pc = frame.pc
+        while pc < size:
+            inst = codes[pc]
+            pc += 1
+            op = inst.opcode
+            # The cheapest, most frequent opcodes run inline to skip a handler call;
+            # Operator keeps the reference versions for LuaVM.excute and fused loops
+            if op == OP_MOVE:
+                stack[base + inst.a] = stack[base + inst.b]
+            elif op == OP_MOVEN:
+                a, b, n = base + inst.a, base + inst.b, inst.c
+                stack[a:a + n] = stack[b:b + n]
+                pc += n - 1
+            elif op == OP_LOADK:
+                stack[base + inst.a] = consts[inst.bx]
+            elif op == OP_JMP:
+                pc = inst.target_pc
+            elif op == OP_FORLOOP:
+                a = base + inst.a
+                step = stack[a + 2].value
+                idx = stack[a].value + step
+                stack[a] = Value.number(idx)
+                if (step > 0 and idx <= stack[a + 1].value) or \
+                   (step <= 0 and idx >= stack[a + 1].value):
+                    pc = inst.target_pc
+                    stack[a + 3] = stack[a]
             else:
-                closure.varargs.append(value)
+                frame.pc = pc
+                DISPATCH[op](inst, self)
+                if op == OP_RETURN:
+                    break
+                pc = frame.pc
+
+    def _run_traced(self):
+        """run() through the reference handlers, printing every step; picked once per frame."""
+        frame = self.call_info[-1]
+        codes = frame.func.codes
+        while frame.pc < len(codes):
+            inst = codes[frame.pc]
+            self.print_inst(inst, frame.pc)
+            frame.pc += 1
+            DISPATCH[inst.opcode](inst, self)
+            self.print_stack()
+            if inst.opcode == OP_RETURN:
+                break
 
-        closure.nrets = nrets
-        closure.ret_idx = func_idx
-        self.push_closure(closure)
+    def precall(self, closure: LClosure, func_idx: int = 0, nargs: int = 0, nrets: int = 0):
+        func_idx += self.base
+        base = func_idx + 1
+        nparams = closure.func.numparams
+        frame = CallInfo(closure, base, func_idx, nrets)
+        frame.varargs = self.stack[base + nparams:base + nargs]
+
+        # Missing parameters and the rest of the callee's registers start out nil
+        top = base + closure.func.maxstacksize
+        self.check_stack(top)
+        start = base + min(nargs, nparams)
+        self.stack[start:top] = [NIL] * (top - start)
+        self.top = top
+        self.push_callinfo(frame)
 
     def pycall(self, closure: PClosure, func_idx: int = 0, args_count: int = 0, nrets: int = 0):
-        closure.stack = []
-        for i in range(args_count):
-            value = self.stack[func_idx + 1 + i]
-            closure.stack.append(value)
+        func_idx += self.base
+        base = func_idx + 1
+        self.top = base + args_count
 
-        self.push_closure(closure)
+        self.push_callinfo(CallInfo(closure, base))
         ret_count = closure.func(self)
-        self.pop_closure()
-
-        ret_start = len(closure.stack) - ret_count
+        self.pop_callinfo()
 
-        for i in range(nrets):
-            ret_value = closure.stack[ret_start + i] if i < ret_count else Value.nil()
-            self.stack[func_idx + i] = ret_value
+        self._move_results(self.top - ret_count, ret_count, func_idx, nrets)
 
     def poscall(self, ret_start, ret_count: int = 0):
-        closure = self.pop_closure()
+        frame = self.pop_callinfo()
 
         # Handle return values
+        ret_start += frame.base
         if ret_count == -1:
-            ret_count = len(closure.stack) - ret_start
-
-        if closure.nrets == -1:
-            closure.nrets = ret_count
-
-        for i in range(closure.nrets):
-            ret_value = closure.stack[ret_start + i] if i < ret_count else Value.nil()
-            self.stack[closure.ret_idx + i] = ret_value
+            ret_count = self.top - ret_start
+
+        self._move_results(ret_start, ret_count, frame.ret_idx, frame.nrets)
+
+    def _move_results(self, src: int, count: int, dst: int, nrets: int):
+        """Move call results down to the function slot and reset top for the caller.
+
+        A multret call (nrets == -1) leaves top just past the last result so the
+        next CALL/RETURN/SETLIST with B == 0 knows how many values there are;
+        otherwise a Lua caller gets its full register window back.
+        """
+        multret = nrets == -1
+        if multret:
+            nrets = count
+        rets = self.stack[src:src + min(count, nrets)]
+        rets.extend([NIL] * (nrets - len(rets)))
+        self.check_stack(dst + nrets)
+        self.stack[dst:dst + nrets] = rets
+
+        top = dst + nrets
+        if not multret and len(self.call_info) > 0:
+            caller = self.call_info[-1]
+            if type(caller.closure) is LClosure:
+                top = caller.base + caller.func.maxstacksize
+        self.top = top
 
     def next(self, idx: int) -> Optional[tuple[Value, Value]]:
-        table = self.stack[idx]
-        key = self.stack[-1]
+        table = self.stack[self.base + idx]
+        key = self.stack[self.top - 1]
         if not table.is_table():
             raise TypeError("next expects a table")
-        return table.value.next(key)
+        result = table.value.next(key.value)
+        if result is None:
+            return None
+        return Value(result[0]), result[1]
 
     def pushpyfunction(self, func: callable):
-        self.stack.append(Value.closure(PClosure(func)))
+        self.pushvalue(Value.closure(PClosure(func)))
 
     def pushvalue(self, val: Value):
-        self.stack.append(val)
+        if self.top == len(self.stack):
+            self.check_stack(self.top + 1)
+        self.stack[self.top] = val
+        self.top += 1
 
     def pushboolean(self, b: bool):
-        self.stack.append(Value.boolean(b))
+        self.pushvalue(Value.boolean(b))
 
     def insert(self, idx: int):
-        val = self.stack.pop()
-        self.stack.insert(idx - 1, val)
+        pos = self.base + idx - 1
+        val = self.stack[self.top - 1]
+        self.stack[pos + 1:self.top] = self.stack[pos:self.top - 1]
+        self.stack[pos] = val
 
     def pushnil(self):
-        self.stack.append(Value.nil())
+        self.pushvalue(NIL)
 
     def _luacall(self, func, *args) -> Value:
         nargs = len(args)
-        func_idx = len(self.stack)
-        self.stack.append(Value.closure(func))
-        self.stack.extend(args)
-        self.call(func_idx, nargs, 1)
+        func_idx = self.top
+        self.pushvalue(Value.closure(func))
+        for arg in args:
+            self.pushvalue(arg)
+        self.call(func_idx - self.base, nargs, 1)
         res = self.stack[func_idx]
-        while len(self.stack) > func_idx:
-            self.stack.pop()
+        self.top = func_idx
         return res
     
     def _get_rk(self, rk: int) -> Value:
@@ -293,14 +376,14 @@ class LuaState:
             return self.func.consts[rk - 256]
         else:
             # It's a register (r)
-            return self.stack[rk]
+            return self.stack[self.base + rk]
         
     def _index2adr(self, idx: int) -> Value:
         """Convert Lua stack index to Value reference"""
         if idx > 0:
-            return self.stack[idx - 1]
+            return self.stack[self.base + idx - 1]
         elif idx > LUA_GLOBALS_INDEX:   # idx < 0
-            return self.stack[len(self.stack) + idx]
+            return self.stack[self.top + idx]
         else:
             if idx == LUA_GLOBALS_INDEX:
                 return Value.table(self.globals)
@@ -317,6 +400,10 @@ class LuaState:
         return self.call_info[-1].fetch()
 
     # debug
+    def print_inst(self, inst: Instruction, pc: int):
+        frame = self.call_info[-1]
+        inst.update_info(pc, frame.func.consts, frame.func.debug.upvalues)
+        print(f"-{len(self.call_info)}- " + str(inst).ljust(40))
+
     def print_stack(self):
-        pass
-        # self.call_info[-1].print_stack()
+        print(f"-{len(self.call_info)}- " + ''.join(f"[{v}]" for v in self.stack[self.base:self.top]))
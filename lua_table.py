@@ -6,25 +6,51 @@ if TYPE_CHECKING:
     from lua_value import Value
 
 
+# Python treats True == 1 and False == 0 (with equal hashes), so boolean keys are
+# boxed in the map part to keep t[true] and t[1] apart; next() unboxes them
+_TRUE_KEY = (bool, True)
+_FALSE_KEY = (bool, False)
+
+
+def _unbox(key: object) -> object:
+    return key[1] if type(key) is tuple else key
+
+
 class Table:
-    _metatable: Table | None = None
+    __slots__ = ('_metatable', '_list', '_map')
+
+    _metatable: Table | None
     _list: list[Value]
-    _map: dict[Value | int, Value]
+    _map: dict[object, Value]  # keyed by the raw Python value of the Lua key, booleans boxed
 
     def __init__(self):
+        self._metatable = None
         self._list = []
         self._map = {}
 
     def get(self, key: int | Value) -> Value | None:
-        int_key = key if type(key) is int else key.get_integer()
-        if int_key is not None:
-            if 1 <= int_key <= len(self._list):
-                return self._list[int_key - 1]
-            return self._map.get(int_key, None)
+        return self.get_raw(key if type(key) is int else key.value)
+
+    def get_raw(self, key: object) -> Value | None:
+        """Look up by the key's underlying Python value, without a Value wrapper."""
+        if type(key) is float and key.is_integer():
+            key = int(key)
+        if type(key) is int and 1 <= key <= len(self._list):
+            return self._list[key - 1]
+        if type(key) is bool:
+            key = _TRUE_KEY if key else _FALSE_KEY
         return self._map.get(key, None)
 
     def set(self, key: int | Value, value: Value):
-        int_key = key if type(key) is int else key.get_integer()
+        self.set_raw(key if type(key) is int else key.value, value)
+
+    def set_raw(self, key: object, value: Value):
+        """Store by the key's underlying Python value, without a Value wrapper."""
+        if type(key) is float and key.is_integer():
+            key = int(key)
+        elif type(key) is bool:
+            key = _TRUE_KEY if key else _FALSE_KEY
+        int_key = key if type(key) is int else None
         if value.is_nil():
             if int_key is not None:
                 if 1 <= int_key <= len(self._list):
@@ -46,29 +72,34 @@ class Table:
     def len(self) -> int:
         return len(self._list)
     
-    def next(self, key: Value) -> tuple[Value, Value] | None:
-        if key.is_nil():
-            if len(self._list) > 0:
-                return Value(1), self._list[0]
-            for k in self._map:
-                return k, self._map[k]
-            return None
-        
-        int_key = key.get_integer()
-        if int_key is not None:
-            return self._list_next(int_key) or self._map_next(int_key)
-        return self._map_next(key)
-    
-    def _list_next(self, key: int) -> tuple[Value, Value] | None:
-        if key < len(self._list):
-            return Value(key + 1), self._list[key]
+    def next(self, key: object) -> tuple[object, Value] | None:
+        """Return the entry after key (None to start) as a raw key and its value, or None at the end.
+
+        The key comes back as its Python value, for the caller to wrap as it needs.
+        """
+        if type(key) is float and key.is_integer():
+            key = int(key)
+        if key is None:
+            index = 0
+        elif type(key) is int and 1 <= key <= len(self._list):
+            index = key
+        else:
+            if type(key) is bool:
+                key = _TRUE_KEY if key else _FALSE_KEY
+            return self._map_next(key)
+
+        if index < len(self._list):
+            return index + 1, self._list[index]
+        # The list part is done; carry on into the map part
+        for k in self._map:
+            return _unbox(k), self._map[k]
         return None
     
-    def _map_next(self, key: Value | int) -> tuple[Value, Value] | None:
+    def _map_next(self, key: object) -> tuple[object, Value] | None:
         found = False
         for k in self._map:
             if found:
-                return k, self._map[k]
+                return _unbox(k), self._map[k]
             if k == key:
                 found = True
         return None
@@ -90,5 +121,5 @@ class Table:
             self._list.append(self._map[key])
             del self._map[key]
 
-    def gettable(self, key: str) -> Value | None:
-        return self.get(Value(key))
+    def gettable(self, key: Value) -> Value | None:
+        return self.get(key)
@@ -24,42 +24,56 @@ class LUA_TYPE(Enum):
 
 
 class Value:
-    value: str | float | int | bool | Table | LClosure | None = None
+    __slots__ = ('value',)
+
+    value: str | float | int | bool | Table | LClosure | None
 
     def __init__(self, value: str | float | int | bool | Table | LClosure | None = None):
-        if value is not None:
-            self.value = value
-        self.conv_float_to_int()
+        if type(value) is float and value.is_integer():
+            value = int(value)
+        self.value = value
     
     @classmethod
     def nil(cls) -> Value:
-        """Create a nil value"""
-        return cls(None)
+        """Return the shared nil value"""
+        return NIL
     
     @classmethod
     def boolean(cls, val: bool) -> Value:
-        """Create a boolean value"""
-        return cls(val)
+        """Return the shared true/false value"""
+        return TRUE if val else FALSE
     
     @classmethod
     def number(cls, val: int | float) -> Value:
-        """Create a number value"""
-        return cls(val)
+        """Create a number value, reusing the shared one for small integers"""
+        if type(val) is float and val.is_integer():
+            val = int(val)
+        if type(val) is int and _SMALL_INT_MIN <= val < _SMALL_INT_MAX:
+            return _SMALL_INTS[val - _SMALL_INT_MIN]
+        value = _new_value(cls)
+        value.value = val  # already normalised above
+        return value
     
     @classmethod
     def string(cls, val: str) -> Value:
         """Create a string value"""
-        return cls(val)
+        value = _new_value(cls)
+        value.value = val  # nothing to normalise
+        return value
     
     @classmethod
     def table(cls, val: Table) -> Value:
         """Create a table value"""
-        return cls(val)
+        value = _new_value(cls)
+        value.value = val
+        return value
     
     @classmethod
     def closure(cls, val: LClosure | PClosure) -> Value:
         """Create a closure value"""
-        return cls(val)
+        value = _new_value(cls)
+        value.value = val
+        return value
 
     def conv_number_to_str(self):
         if self.is_number():
@@ -143,7 +157,7 @@ class Value:
             return value
             
         mt = self.get_metatable()
-        index = mt.get(Value.string("__index")) if mt else None
+        index = mt.get_raw("__index") if mt else None
         if index:
             if index.is_function():
                 assert caller is not None, "__index metamethod requires a caller"
@@ -154,7 +168,7 @@ class Value:
     
     def len(self, caller: LuaCallable | None = None) -> int:
         mt = self.get_metatable()
-        length = mt.get(Value.string("__len")) if mt else None
+        length = mt.get_raw("__len") if mt else None
         if length and length.is_function():
             assert caller is not None, "__len metamethod requires a caller"
             result = caller(length.value, self)
@@ -174,14 +188,32 @@ class Value:
         return self.value == other.value
 
     def __repr__(self) -> str:
-        if self.is_nil():
+        # Branch on the Python type once instead of walking the is_* predicates
+        value = self.value
+        value_type = type(value)
+        if value_type is str:
+            return f'"{value}"'
+        elif value_type is int or value_type is float:
+            return str(value)
+        elif value is None:
             return 'nil'
-        elif self.is_boolean():
-            return 'true' if self.value else 'false'
-        elif self.is_string():
-            return f'"{self.value}"'
-        elif self.is_table():
+        elif value_type is bool:
+            return 'true' if value else 'false'
+        elif value_type is Table:
             return 'table'
-        elif self.is_function():
+        elif value_type is LClosure or value_type is PClosure:
             return 'function'
-        return str(self.value)
+        return str(value)
+
+
+_new_value = object.__new__
+
+# nil carries no state, so every nil slot can reference this one instance
+NIL = Value()
+TRUE = Value(True)
+FALSE = Value(False)
+
+# Numbers are never mutated in place either, so loop counters and small
+# arithmetic results can share preallocated values
+_SMALL_INT_MIN, _SMALL_INT_MAX = -128, 1024
+_SMALL_INTS = tuple(Value(i) for i in range(_SMALL_INT_MIN, _SMALL_INT_MAX))
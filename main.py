@@ -1,11 +1,17 @@
 """Lua bytecode loader and VM entry point."""
 from __future__ import annotations
 
+import os
+import struct
+import sys
+from mmap import mmap, ACCESS_READ
+from typing import TextIO
+
 from lua_io import Reader
 from lua_bin import read_header, read_proto
 from lua_function import Proto
 from lua_state import LuaState
-from lua_operator import Operator
+from lua_operator import DISPATCH
 from lua_lexer import Lexer
 from lua_block import Block
 
@@ -17,32 +23,81 @@ class LuaVM:
 
     @staticmethod
     def excute(state: LuaState) -> bool:
-        inst = LuaVM.fetch(state)
-        if inst is None:
+        if len(state.call_info) == 0:
+            return False
+        frame = state.call_info[-1]
+        codes = frame.func.codes
+        if frame.pc >= len(codes):
             return False
-        op_name = inst.op_name()
-        method = getattr(Operator, op_name, None)
-        if method:
-            # print(f"-{len(state.call_info)}- " +  str(inst).ljust(40))
-            method(inst, state)
-            # print(f"-{len(state.call_info)}- " +  ''.join(f"[{v}]" for v in state.stack))
+        inst = codes[frame.pc]
+        if LuaState.trace:
+            state.print_inst(inst, frame.pc)
+        frame.pc += 1
+        DISPATCH[inst.opcode](inst, state)
+        if LuaState.trace:
+            state.print_stack()
         return True
 
+    @staticmethod
+    def run(state: LuaState):
+        state.run()
+
     @staticmethod
     def get_rk(state: LuaState, rk: int):
         return state._get_rk(rk)
 
 
+# Listings run to megabytes for large chunks; flush them to stdout in big writes
+_DUMP_BUFFER_SIZE = 256 * 1024
+
+
 class PyLua:
     reader: Reader
     header: Header
     main: Proto
 
     def __init__(self, file_path: str):
+        # Map the file rather than reading it; everything parsed out of it is copied
         with open(file_path, 'rb') as f:
-            self.reader = Reader(f)
+            if os.fstat(f.fileno()).st_size == 0:
+                raise EOFError("Unexpected end of file")  # mmap can't map an empty file
+            with mmap(f.fileno(), 0, access=ACCESS_READ) as buf:
+                self._load(buf)
+
+    @classmethod
+    def parse(cls, data: bytes | bytearray | memoryview) -> PyLua:
+        """Load a chunk that is already in memory, such as one read whole or produced by string.dump."""
+        pylua = cls.__new__(cls)
+        # Reader needs slices that hash and decode; bytes(data) is free when data already is bytes
+        pylua._load(bytes(data))
+        return pylua
+
+    def _load(self, buf: bytes | mmap):
+        self.reader = Reader(buf)
+        try:
             self.header = read_header(self.reader)
             self.main = read_proto(self.reader)
+        except (struct.error, IndexError) as e:
+            # Reader's fixed-size reads don't check bounds themselves; a short buffer surfaces here
+            raise EOFError("Unexpected end of file") from e
+
+    def dump(self, out: TextIO | None = None):
+        """Write the listing to out, or to stdout through a large buffer."""
+        if out is not None:
+            self.main.dump(out)
+            return
+
+        try:
+            fd = sys.stdout.fileno()
+        except (AttributeError, OSError):  # io.UnsupportedOperation is an OSError
+            # stdout was replaced (redirect_stdout, captured output, IDLE); write to it as is
+            self.main.dump(sys.stdout)
+            return
+
+        sys.stdout.flush()
+        with open(fd, 'w', buffering=_DUMP_BUFFER_SIZE,
+                  encoding=sys.stdout.encoding, closefd=False) as out:
+            self.main.dump(out)
 
     def __str__(self) -> str:
         return f"{self.main}"
@@ -55,7 +110,7 @@ if __name__ == "__main__":
     Block.parse(lexer)
 
     # pylua_file = PyLua("test.luac")
-    # print(pylua_file)
+    # pylua_file.dump()
 
     # state = LuaState(pylua_file.main)
     # while LuaVM.excute(state):